@@ -1,45 +1,45 @@
 import os
-from openai import OpenAI
+import re
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+import openai
+from openai import AsyncOpenAI
+from tenacity import retry, stop_after_attempt, wait_exponential_jitter, retry_if_exception_type
+from tools.nelli_http import shared_async_http
 from tools.find_papers import BiorxivAgent
 from tools.summarize_papers import PaperSummarizer
 from tools.generate_paper_images import PaperImageGenerator
+from tools.batch_llm import submit_batch
 
-# Initialize OpenAI with LBL specifics
-client = OpenAI(
+# Initialize OpenAI with LBL specifics (async so multiple queries can share one event loop)
+aclient = AsyncOpenAI(
     api_key=os.environ.get('CBORG_API_KEY'),
-    base_url="https://api.cborg.lbl.gov"
+    base_url="https://api.cborg.lbl.gov",
+    http_client=shared_async_http
 )
 
-class AIAgent:
-    def __init__(self):
-        self.model = "lbl/cborg-chat:latest"
-        self.biorxiv_agent = BiorxivAgent()
-        self.paper_summarizer = PaperSummarizer()
-        self.image_generator = PaperImageGenerator()
-        self.last_paper_doi = None  # Store the last paper's DOI
-        
-        # Add default authors of interest
-        default_authors = [
-            "Schulz, F.",
-            "Shrestha, B.",
-            "Vasquez, Y.M.",
-            "Villada, J. C.",
-            "Romero, M. F.",
-            "Bowers, R."
-        ]
-        for author in default_authors:
-            self.biorxiv_agent.add_author_of_interest(author)
+# Compiled once at import instead of per call
+_DOI_RE = re.compile(r'10\.\d{4,9}/[-._;()/:\w]+')
+_AUTHOR_SPLIT = re.compile(r'\s+and\s+|&|,')
 
-    def process_query(self, query: str) -> str:
-        """Process a natural language query and return appropriate response"""
-        try:
-            # First, determine what the user wants to do
-            system_prompt = """You are a helpful research assistant for the NeLLi group. 
+# Separator line used when formatting paper listings
+SEP = "=" * 50 + "\n"
+
+# Router system prompt: a static ~1.5 KB literal, built once at import so
+# every classification reuses the same message object
+_ROUTER_SYSTEM_PROMPT = """You are a helpful research assistant for the NeLLi group.
             Your task is to understand what the user wants to do and respond appropriately.
             You can help with:
             1. Finding recent papers from specific authors (with optional date range)
             2. Summarizing papers (requires a DOI)
             3. Generating images for papers (requires a DOI)
+            4. Summarizing all papers from the most recent search at once
             
             For date ranges, you can understand formats like:
             - "last week"
@@ -52,7 +52,7 @@ class AIAgent:
             
             You MUST respond with a valid JSON object in exactly this format:
             {
-                "action": "find_papers" | "summarize_paper" | "generate_image",
+                "action": "find_papers" | "summarize_paper" | "generate_image" | "summarize_all",
                 "params": {
                     "query": "the actual query to use",
                     "start_date": "YYYY-MM-DD" or null,
@@ -103,76 +103,209 @@ class AIAgent:
             IMPORTANT: Your response must be a valid JSON object with no additional text or explanation.
             """
 
-            response = client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": query}
-                ],
-                temperature=0.1  # Lower temperature for more consistent JSON output
+_ROUTER_SYSTEM_MSG = {"role": "system", "content": _ROUTER_SYSTEM_PROMPT}
+
+
+def _router_messages(query: str) -> list:
+    """Build the classifier messages around the precomputed system message"""
+    return [_ROUTER_SYSTEM_MSG, {"role": "user", "content": query}]
+
+
+# Transient provider errors worth retrying instead of surfacing to the user
+_RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)
+
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential_jitter(initial=0.5, max=8),
+       retry=retry_if_exception_type(_RETRYABLE_ERRORS))
+async def _llm_call(**kwargs):
+    """chat.completions.create with exponential backoff on rate limits and timeouts"""
+    return await aclient.chat.completions.create(**kwargs)
+
+class AIAgent:
+    def __init__(self):
+        self.model = "lbl/cborg-chat:latest"
+        self.biorxiv_agent = BiorxivAgent()
+        self.paper_summarizer = PaperSummarizer()
+        self.image_generator = PaperImageGenerator()
+        self.last_paper_dois = []  # DOIs from the last find_papers result, for bulk summarization
+        self._classifier_cache = {}  # Normalized query -> classification result
+        self._paper_cache = {}  # DOI -> paper details, shared by summarize and image flows
+
+        # Persist the last paper DOI and classifier cache across REPL sessions
+        self._db = sqlite3.connect(Path.home() / ".nelli_agent.db", isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS classifier_cache ("
+            "query_hash TEXT PRIMARY KEY, action TEXT, params_json TEXT, created_at INTEGER)"
+        )
+        row = self._db.execute("SELECT value FROM state WHERE key='last_paper_doi'").fetchone()
+        self._last_paper_doi = row[0] if row else None  # Store the last paper's DOI
+        
+        # Add default authors of interest
+        default_authors = [
+            "Schulz, F.",
+            "Shrestha, B.",
+            "Vasquez, Y.M.",
+            "Villada, J. C.",
+            "Romero, M. F.",
+            "Bowers, R."
+        ]
+        self.biorxiv_agent.add_authors_of_interest(default_authors)
+
+    @property
+    def last_paper_doi(self):
+        return self._last_paper_doi
+
+    @last_paper_doi.setter
+    def last_paper_doi(self, doi):
+        self._last_paper_doi = doi
+        if doi:
+            self._db.execute(
+                "INSERT INTO state (key, value) VALUES ('last_paper_doi', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (doi,)
             )
-            
-            # Parse the response
-            import json
-            try:
-                # Clean the response to ensure it's valid JSON
-                response_text = response.choices[0].message.content.strip()
-                # Remove any markdown code block markers if present
-                response_text = response_text.replace('```json', '').replace('```', '').strip()
-                
-                result = json.loads(response_text)
-                action = result.get("action")
-                params = result.get("params", {})
-                query = params.get("query", "")
-                start_date = params.get("start_date")
-                end_date = params.get("end_date")
-                use_last_paper = params.get("use_last_paper", False)
-                
-                if action == "find_papers":
-                    return self._find_papers(query, start_date, end_date)
-                elif action == "summarize_paper":
-                    if use_last_paper and self.last_paper_doi:
-                        return self._summarize_paper(self.last_paper_doi)
-                    return self._summarize_paper(query)
-                elif action == "generate_image":
-                    if use_last_paper and self.last_paper_doi:
-                        return self._generate_image(self.last_paper_doi)
-                    return self._generate_image(query)
-                else:
-                    return "I'm not sure what you want to do. You can ask me to:\n" + \
-                           "1. Find recent papers (e.g., 'find papers by Schulz and Shrestha from last week')\n" + \
-                           "2. Summarize a paper (e.g., 'summarize paper with DOI 10.1101/2024.03.15.585123')\n" + \
-                           "3. Generate an image for a paper (e.g., 'generate image for paper with DOI 10.1101/2024.03.15.585123')"
-            
-            except json.JSONDecodeError as e:
-                print(f"Debug - Raw response: {response_text}")  # Debug print
-                print(f"Debug - JSON error: {str(e)}")  # Debug print
+
+    async def _classify(self, query: str) -> dict:
+        """Classify a query into an action and params, caching results by normalized query.
+
+        The classification step runs at temperature 0.1 and is effectively
+        deterministic, so repeated queries ("summarize this paper") skip the
+        LLM call and its prompt-token cost entirely. A manual dict cache is
+        used because lru_cache does not work on coroutine methods.
+        """
+        cache_key = query.strip().lower()
+        if cache_key in self._classifier_cache:
+            return self._classifier_cache[cache_key]
+
+        # Fall back to the on-disk cache from previous sessions
+        query_hash = hashlib.sha256(cache_key.encode()).hexdigest()
+        row = self._db.execute(
+            "SELECT action, params_json FROM classifier_cache WHERE query_hash = ?",
+            (query_hash,)
+        ).fetchone()
+        if row:
+            result = {"action": row[0], "params": json.loads(row[1])}
+            self._classifier_cache[cache_key] = result
+            return result
+
+        response = await _llm_call(
+            model=self.model,
+            messages=_router_messages(query),
+            temperature=0.1  # Lower temperature for more consistent JSON output
+        )
+
+        # Parse the response
+        try:
+            # Clean the response to ensure it's valid JSON
+            response_text = response.choices[0].message.content.strip()
+            # Remove any markdown code block markers if present
+            response_text = response_text.replace('```json', '').replace('```', '').strip()
+
+            result = json.loads(response_text)
+        except json.JSONDecodeError as e:
+            print(f"Debug - Raw response: {response_text}")  # Debug print
+            print(f"Debug - JSON error: {str(e)}")  # Debug print
+            return None
+
+        # Keep the cache bounded; evict the oldest entry once full
+        if len(self._classifier_cache) >= 1024:
+            self._classifier_cache.pop(next(iter(self._classifier_cache)))
+        self._classifier_cache[cache_key] = result
+        self._db.execute(
+            "INSERT OR REPLACE INTO classifier_cache (query_hash, action, params_json, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            (query_hash, result.get("action", ""), json.dumps(result.get("params", {})), int(time.time()))
+        )
+        return result
+
+    async def process_query(self, query: str) -> str:
+        """Process a natural language query and return appropriate response"""
+        try:
+            # Cheap local routing first: when the query already carries a DOI (or
+            # clearly refers to the last paper) plus an obvious verb, dispatch
+            # directly and skip the LLM classifier and its prompt cost entirely.
+            doi_match = _DOI_RE.search(query)
+            low = query.lower()
+            # _summarize_paper and _generate_image block (sync requests
+            # session plus sync OpenAI call), so they run in worker threads
+            # to keep concurrent queries in process_queries moving
+            if doi_match and "summar" in low:
+                return await asyncio.to_thread(self._summarize_paper, doi_match.group(0))
+            if doi_match and ("image" in low or "figure" in low):
+                return await asyncio.to_thread(self._generate_image, doi_match.group(0))
+            # Require the full "... paper" phrases so bulk requests like
+            # "summarize all papers from the last search" still reach the
+            # classifier's summarize_all action
+            if self.last_paper_doi and ("this paper" in low or "last paper" in low
+                                        or "previous paper" in low):
+                if "summar" in low:
+                    return await asyncio.to_thread(self._summarize_paper, self.last_paper_doi)
+                if "image" in low or "figure" in low:
+                    return await asyncio.to_thread(self._generate_image, self.last_paper_doi)
+
+            result = await self._classify(query)
+            if result is None:
                 return "I had trouble understanding your request. Please try again with a clearer query."
-                
+
+            action = result.get("action")
+            params = result.get("params", {})
+            query = params.get("query", "")
+            start_date = params.get("start_date")
+            end_date = params.get("end_date")
+            use_last_paper = params.get("use_last_paper", False)
+
+            if action == "find_papers":
+                return await self._find_papers(query, start_date, end_date)
+            elif action == "summarize_paper":
+                if use_last_paper and self.last_paper_doi:
+                    return await asyncio.to_thread(self._summarize_paper, self.last_paper_doi)
+                return await asyncio.to_thread(self._summarize_paper, query)
+            elif action == "generate_image":
+                if use_last_paper and self.last_paper_doi:
+                    return await asyncio.to_thread(self._generate_image, self.last_paper_doi)
+                return await asyncio.to_thread(self._generate_image, query)
+            elif action == "summarize_all":
+                # summarize_all blocks (thread-pool joins, possibly batch
+                # polling); run it in a worker thread so concurrent queries
+                # in process_queries keep making progress
+                summaries = await asyncio.to_thread(self.summarize_all)
+                if not summaries:
+                    return "No papers from a previous search to summarize."
+                return "\n\n".join(f"DOI: {doi}\n{summary}" for doi, summary in summaries.items())
+            else:
+                return "I'm not sure what you want to do. You can ask me to:\n" + \
+                       "1. Find recent papers (e.g., 'find papers by Schulz and Shrestha from last week')\n" + \
+                       "2. Summarize a paper (e.g., 'summarize paper with DOI 10.1101/2024.03.15.585123')\n" + \
+                       "3. Generate an image for a paper (e.g., 'generate image for paper with DOI 10.1101/2024.03.15.585123')"
+
         except Exception as e:
             print(f"Debug - Error: {str(e)}")  # Debug print
             return f"An error occurred: {str(e)}"
 
-    def _find_papers(self, query: str, start_date: str = None, end_date: str = None) -> str:
+    async def process_queries(self, queries: list) -> list:
+        """Process several queries concurrently so N queries cost ~1 round-trip of latency"""
+        return await asyncio.gather(*(self.process_query(q) for q in queries))
+
+    async def _find_papers(self, query: str, start_date: str = None, end_date: str = None) -> str:
         """Find papers based on the query and date range"""
-        # Parse authors from the query, handling various formats
-        authors = []
-        # Split by common conjunctions and punctuation
-        for part in query.replace(' and ', ',').replace('&', ',').split(','):
-            author = part.strip()
-            # Remove common prefixes
-            author = author.replace('by ', '').replace('from ', '').replace('author ', '')
-            if author:
-                authors.append(author)
+        # Parse authors from the query, splitting on common conjunctions and
+        # punctuation and stripping common prefixes
+        authors = [
+            a.strip().removeprefix('by ').removeprefix('from ').removeprefix('author ')
+            for a in _AUTHOR_SPLIT.split(query) if a.strip()
+        ]
         
         print(f"Debug - Searching for authors: {authors}")  # Debug print
         
-        # Add any new authors to the agent
-        for author in authors:
-            self.biorxiv_agent.add_author_of_interest(author)
+        # Add only the authors the agent is not already tracking, in one batch
+        new_authors = [a for a in authors if a not in self.biorxiv_agent.authors_of_interest]
+        if new_authors:
+            self.biorxiv_agent.add_authors_of_interest(new_authors)
         
         # Set date range if not provided
-        from datetime import datetime, timedelta
         if not end_date:
             end_date = datetime.now().strftime('%Y-%m-%d')
         if not start_date:
@@ -180,61 +313,102 @@ class AIAgent:
         
         print(f"Debug - Date range: {start_date} to {end_date}")  # Debug print
         
-        # Search for papers
-        found_papers = self.biorxiv_agent.search_authors_with_cursor(start_date, end_date, authors)
-        
+        # Search for papers, fetching the cursor pages concurrently
+        found_papers = await self.biorxiv_agent.search_authors_with_cursor_async(start_date, end_date, authors)
+
         if not found_papers:
             return f"No papers found for authors {', '.join(authors)} between {start_date} and {end_date}."
         
         # Store the DOI of the first paper found
         if found_papers:
             self.last_paper_doi = found_papers[0]['doi']
+            self.last_paper_dois = [paper['doi'] for paper in found_papers]
         
-        # Format the results
-        result = f"Found {len(found_papers)} papers for authors: {', '.join(authors)}\n"
-        result += f"Date range: {start_date} to {end_date}\n\n"
+        # Format the results; build a list and join once instead of growing a string
+        parts = []
+        parts.append(f"Found {len(found_papers)} papers for authors: {', '.join(authors)}\n")
+        parts.append(f"Date range: {start_date} to {end_date}\n\n")
         for paper in found_papers:
-            result += f"Title: {paper['title']}\n"
-            result += "Authors:\n"
-            for author in paper['matching_authors']:
-                result += f"  - {author['name']} ({author['affiliation']})\n"
-            result += f"Date: {paper['date']}\n"
-            result += f"DOI: {paper['doi']}\n"
-            result += "="*50 + "\n"
-        
-        result += "\nYou can now ask me to 'summarize this paper' or 'generate an image for this paper'."
-        return result
+            authors_block = "\n".join(
+                f"  - {a['name']} ({a['affiliation']})" for a in paper['matching_authors']
+            )
+            parts.append(
+                f"Title: {paper['title']}\nAuthors:\n{authors_block}\n"
+                f"Date: {paper['date']}\nDOI: {paper['doi']}\n{SEP}"
+            )
+
+        parts.append("\nYou can now ask me to 'summarize this paper' or 'generate an image for this paper'.")
+        return "".join(parts)
+
+    def _fetch_paper(self, doi: str) -> dict:
+        """Fetch paper details once per DOI; summarize and image requests for the
+        same paper hit the same bioRxiv endpoint, so the second call is free.
+        Failed fetches are not cached so they can be retried."""
+        if doi in self._paper_cache:
+            return self._paper_cache[doi]
+
+        paper_data = self.paper_summarizer.get_paper_by_doi(doi)
+        if paper_data:
+            self._paper_cache[doi] = paper_data
+        return paper_data
 
     def _summarize_paper(self, query: str) -> str:
         """Summarize a paper based on its DOI"""
-        import re
-        doi_pattern = r'10\.\d{4,9}/[-._;()/:\w]+'
-        doi_match = re.search(doi_pattern, query)
-        
+        doi_match = _DOI_RE.search(query)
+
         if not doi_match:
             return "No valid DOI found in the query."
-        
+
         doi = doi_match.group(0)
-        paper_data = self.paper_summarizer.get_paper_by_doi(doi)
-        
+        paper_data = self._fetch_paper(doi)
+
         if not paper_data:
             return "Could not fetch paper data for the given DOI."
         
         summary = self.paper_summarizer.summarize_paper(paper_data)
         return summary
 
+    def summarize_all(self, use_batch_api: bool = False) -> dict:
+        """Summarize every paper from the last find_papers result.
+
+        The default path fans the per-paper fetch + LLM calls out over a
+        thread pool (both are I/O-bound, so wall time is roughly the slowest
+        paper rather than the sum). With use_batch_api=True the prompts go
+        out as a single Batch API job instead, which is cheaper but may take
+        up to 24h to complete.
+        """
+        if not self.last_paper_dois:
+            return {}
+
+        if not use_batch_api:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                return dict(zip(self.last_paper_dois,
+                                executor.map(self._summarize_paper, self.last_paper_dois)))
+
+        requests = []
+        for doi in self.last_paper_dois:
+            paper_data = self.paper_summarizer.get_paper_by_doi(doi)
+            if paper_data:
+                requests.append({
+                    "custom_id": doi,
+                    "body": self.paper_summarizer._build_prompt(paper_data)
+                })
+
+        if not requests:
+            return {}
+
+        return submit_batch(requests)
+
     def _generate_image(self, query: str) -> str:
         """Generate an image for a paper based on its DOI"""
-        import re
-        doi_pattern = r'10\.\d{4,9}/[-._;()/:\w]+'
-        doi_match = re.search(doi_pattern, query)
-        
+        doi_match = _DOI_RE.search(query)
+
         if not doi_match:
             return "No valid DOI found in the query."
         
         doi = doi_match.group(0)
-        paper_data = self.image_generator.get_paper_by_doi(doi)
-        
+        paper_data = self._fetch_paper(doi)
+
         if not paper_data:
             return "Could not fetch paper data for the given DOI."
         
@@ -247,7 +421,10 @@ class AIAgent:
         
         return f"Image generated successfully. Prompt used: {image_prompt}"
 
-def main():
+async def async_main():
+    # The whole REPL runs on one event loop: shared_async_http's pooled
+    # connections are bound to the loop they were opened on, so spinning up
+    # a fresh loop per query would fail on the second networked request.
     agent = AIAgent()
     print("Welcome to the NeLLi Research Assistant!")
     print("You can ask me to:")
@@ -255,14 +432,17 @@ def main():
     print("2. Summarize a paper (e.g., 'summarize paper with DOI 10.1101/2024.03.15.585123')")
     print("3. Generate an image for a paper (e.g., 'generate image for paper with DOI 10.1101/2024.03.15.585123')")
     print("\nType 'quit' to exit.")
-    
+
     while True:
         query = input("\nWhat would you like me to do? ").strip()
         if query.lower() == 'quit':
             break
-            
-        response = agent.process_query(query)
+
+        response = await agent.process_query(query)
         print("\n" + response)
 
+def main():
+    asyncio.run(async_main())
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -1,8 +1,19 @@
 import requests
 import re
 import os
+import json
 from datetime import datetime, timedelta
+
+try:
+    # orjson is ~2-3x faster than stdlib json on small payloads
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+import openai
 from openai import OpenAI
+from tenacity import retry, stop_after_attempt, wait_exponential_jitter, retry_if_exception_type
+from tools.nelli_http import shared_http
 from tools.find_papers import BiorxivAgent
 from tools.summarize_papers import PaperSummarizer
 from tools.generate_paper_images import PaperImageGenerator
@@ -10,57 +21,83 @@ from tools.generate_paper_images import PaperImageGenerator
 # Initialize OpenAI with LBL specifics
 client = OpenAI(
     api_key=os.environ.get('CBORG_API_KEY'),
-    base_url="https://api.cborg.lbl.gov"
+    base_url="https://api.cborg.lbl.gov",
+    http_client=shared_http
 )
 
 model = "lbl/cborg-chat:latest"
 
+# Compiled once at import instead of per call
+_DOI_RE = re.compile(r'10\.\d{4,9}/[-._;()/:\w]+')
+
+# Separator line used when formatting paper listings
+SEP = "=" * 50 + "\n"
+
+# Transient provider errors worth retrying instead of failing the whole response
+_RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)
+
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential_jitter(initial=0.5, max=8),
+       retry=retry_if_exception_type(_RETRYABLE_ERRORS))
+def _llm_call(**kwargs):
+    """chat.completions.create with exponential backoff on rate limits and timeouts"""
+    return client.chat.completions.create(**kwargs)
+
 FUNCTION_DEFINITIONS = [
     {
-        "name": "find_papers",
-        "description": "Retrieve recent papers from bioarxiv from the NeLLi group",
-        "parameters": {
-            "type": "dict",
-            "required": [
-                "query"
-            ],
-            "properties": {
-                "query": {
-                    "type": "str",
-                    "description": "The query to utilize to get papers from bioarxiv api"
-                },
+        "type": "function",
+        "function": {
+            "name": "find_papers",
+            "description": "Retrieve recent papers from bioarxiv from the NeLLi group",
+            "parameters": {
+                "type": "object",
+                "required": [
+                    "query"
+                ],
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "The query to utilize to get papers from bioarxiv api"
+                    },
+                }
             }
         }
     },
     {
-        "name": "summarize_papers",
-        "description": "Summarize papers for bluesky (300 word count), currently based on abstracts",
-        "parameters": {
-            "type": "dict",
-            "required": [
-                "query"
-            ],
-            "properties": {
-                "query": {
-                    "type": "str",
-                    "description": "The query to utilize to summarize paper abstract in 300 word count"
-                },
+        "type": "function",
+        "function": {
+            "name": "summarize_papers",
+            "description": "Summarize papers for bluesky (300 word count), currently based on abstracts",
+            "parameters": {
+                "type": "object",
+                "required": [
+                    "query"
+                ],
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "The query to utilize to summarize paper abstract in 300 word count"
+                    },
+                }
             }
         }
     },
     {
-        "name": "generate_paper_images",
-        "description": "Generate images based on the abstract of the paper",
-        "parameters": {
-            "type": "dict",
-            "required": [
-                "query"
-            ],
-            "properties": {
-                "query": {
-                    "type": "str",
-                    "description": "The query to generate image of the paper"
-                },
+        "type": "function",
+        "function": {
+            "name": "generate_paper_images",
+            "description": "Generate images based on the abstract of the paper",
+            "parameters": {
+                "type": "object",
+                "required": [
+                    "query"
+                ],
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "The query to generate image of the paper"
+                    },
+                }
             }
         }
     },
@@ -84,27 +121,26 @@ def find_papers_codehere(query: str) -> str:
     if not found_papers:
         return "No papers found for the specified authors."
     
-    # Format the results
-    result = "Found papers:\n\n"
+    # Format the results; build a list and join once instead of growing a string
+    parts = ["Found papers:\n\n"]
     for paper in found_papers:
-        result += f"Title: {paper['title']}\n"
-        result += "Authors:\n"
-        for author in paper['matching_authors']:
-            result += f"  - {author['name']} ({author['affiliation']})\n"
-        result += f"Date: {paper['date']}\n"
-        result += f"DOI: {paper['doi']}\n"
-        result += "="*50 + "\n"
-    
-    return result
+        authors_block = "\n".join(
+            f"  - {a['name']} ({a['affiliation']})" for a in paper['matching_authors']
+        )
+        parts.append(
+            f"Title: {paper['title']}\nAuthors:\n{authors_block}\n"
+            f"Date: {paper['date']}\nDOI: {paper['doi']}\n{SEP}"
+        )
+
+    return "".join(parts)
 
 def summarize_papers_codehere(query: str) -> str:
     """Wrapper function for summarizing papers"""
     summarizer = PaperSummarizer()
-    
+
     # Extract DOI from query
-    doi_pattern = r'10\.\d{4,9}/[-._;()/:\w]+'
-    doi_match = re.search(doi_pattern, query)
-    
+    doi_match = _DOI_RE.search(query)
+
     if not doi_match:
         return "No valid DOI found in the query."
     
@@ -120,11 +156,10 @@ def summarize_papers_codehere(query: str) -> str:
 def generate_paper_images_codehere(query: str) -> str:
     """Wrapper function for generating paper images"""
     generator = PaperImageGenerator()
-    
+
     # Extract DOI from query
-    doi_pattern = r'10\.\d{4,9}/[-._;()/:\w]+'
-    doi_match = re.search(doi_pattern, query)
-    
+    doi_match = _DOI_RE.search(query)
+
     if not doi_match:
         return "No valid DOI found in the query."
     
@@ -145,131 +180,108 @@ def generate_paper_images_codehere(query: str) -> str:
 
 class LanguageModelWrapper:
 
-    def _parse_function_call(self, response_text):
-        """Parse a function call from the model's response"""
-        try:
-            # Extract function name and parameters
-            func_name = response_text.split('(')[0].strip()
-            # Extract everything between parentheses
-            params_str = response_text[response_text.find('(')+1:response_text.rfind(')')]
-            # Parse parameters
-            params = {}
-            if 'query="' in params_str:  # Handle quoted string parameters
-                params['query'] = params_str.split('query="')[1].split('"')[0]
-            return func_name, params
-        except Exception as e:
-            print(f"Error parsing function call: {e}")
-            return None, None
-
     def _execute_function(self, func_name, params):
         """Execute the specified function with given parameters"""
-        function_mapping = {
-            'find_papers': find_papers_codehere,
-            'summarize_papers': summarize_papers_codehere,
-            'generate_paper_images': generate_paper_images_codehere,
-            # Add new functions here as they become available
-            # 'another_function': another_function,
-        }
-        
-        if func_name in function_mapping:
-            try:
-                return function_mapping[func_name](**params)
-            except Exception as e:
-                print(f"Error executing function {func_name}: {e}")
-                return None
-        return None
-
-
-    def generate_response(self, prompt, model="lbl/cborg-chat:latest"):
-        """Send request to CBORG API"""
         try:
-            # First step: Research prompt
-            research_prompt = f"""You are a science communicator assistant.
-            Based on the following topic, determine if you need to gather additional information.
-            If you do, you can use one of these available functions:
-
-            {str(FUNCTION_DEFINITIONS)}
-
-            Use find_papers_codehere when you need:
-            - Find recent papers from the NeLLi group authors from bioarxiv
-
-            Use summarize_papers_codehere when you need:
-            - Summarize paper abstract in 300 words in order to be ready to publish in bluesky
-
-            Use generate_paper_images when you need:
-            - To generate an image based on the abstract
-
-
-            Format your response exactly like this if you want to call a function:
-            FUNCTION: function_name(param_name="param_value")
-
-            If you don't need to gather information, respond with:
-            NO_FUNCTION_NEEDED
-
-            Topic: {prompt}
+            # Add new functions here as they become available
+            match func_name:
+                case 'find_papers':
+                    return find_papers_codehere(params.get('query', ''))
+                case 'summarize_papers':
+                    return summarize_papers_codehere(params.get('query', ''))
+                case 'generate_paper_images':
+                    return generate_paper_images_codehere(params.get('query', ''))
+                case _:
+                    return None
+        except Exception as e:
+            print(f"Error executing function {func_name}: {e}")
+            return None
 
-            Note: You can only call one function at a time.
-            """
 
-            # Get function call decision
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are a science communicator assistant that helps determine when to use specific functions for gathering information."},
-                    {"role": "user", "content": research_prompt}
-                ]
-            )
-            function_response = response.choices[0].message.content.strip()
-            
-            research_results = ""
-            func_name = None
+    def generate_response(self, prompt, model="lbl/cborg-chat:latest", stream_callback=None):
+        """Send request to CBORG API.
 
-            # Check if a single function call is needed
-            if function_response.startswith("FUNCTION:"):
-                function_call = function_response.replace("FUNCTION:", "").strip()
-                func_name, params = self._parse_function_call(function_call)
-                
-                if func_name and params:
-                    research_results = self._execute_function(func_name, params)
-                else:
-                    print("Failed to parse function call")
-                    research_results = ""
-            else:
-                research_results = ""
-
-            # Second step: Tweet generation
-            post_prompt = """You are a member of the NeLLi research group, a group focused on the new lineages of life.
+        When stream_callback is given, the tweet-generation step streams and the
+        callback receives each text delta as it arrives, so callers can start
+        rendering at first-token latency instead of waiting for the full
+        completion. The tool-selection step stays non-streaming since its
+        output is short.
+        """
+        try:
+            system_prompt = """You are a member of the NeLLi research group, a group focused on the new lineages of life.
             Write tweets that reflect my voice and expertise in new lineages of life and science.
+            If you need to gather additional information first (recent papers, a paper summary,
+            or a paper image), call one of the available functions; otherwise respond with the
+            tweet directly.
 
             Tweet Style Guide:
             - Write in a confident yet approachable tone
             - Use active voice and present tense
             - Keep it conversational and engaging
             - Maximum 300 characters
-            
+
             Format:
             - No quotes
             - No random capitalization
+
+            Respond with ONLY the tweet text, nothing else.
             """
 
-            # Add research results if available
-            if research_results:
-                post_prompt += f"\nHere is additional context that you can use to write such post:\n{research_results}"
-            
-            post_prompt += f"\nTopic: {prompt}\n\nRespond with ONLY the tweet text, nothing else."
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"Topic: {prompt}"}
+            ]
 
-            response = client.chat.completions.create(
+            # Single call: the model either picks a tool or writes the tweet directly
+            response = _llm_call(
                 model=model,
-                messages=[
-                    {"role": "system", "content": "You are a member of the NeLLi research group, focused on writing engaging social media posts about new lineages of life and science."},
-                    {"role": "user", "content": post_prompt}
-                ]
+                messages=messages,
+                tools=FUNCTION_DEFINITIONS,
+                tool_choice="auto"
             )
+            message = response.choices[0].message
+
+            func_name = None
+            if message.tool_calls:
+                # Execute the requested tool and do one follow-up call for the tweet
+                tool_call = message.tool_calls[0]
+                func_name = tool_call.function.name
+                try:
+                    params = _json_loads(tool_call.function.arguments)
+                except ValueError as e:
+                    print(f"Error parsing tool arguments: {e}")
+                    params = {}
+                research_results = self._execute_function(func_name, params)
+
+                messages.append(message)
+                messages.append({
+                    "role": "tool",
+                    "tool_call_id": tool_call.id,
+                    "content": research_results or ""
+                })
+
+                # Stream the tweet so output is available at first-token latency
+                stream = _llm_call(
+                    model=model,
+                    messages=messages,
+                    stream=True
+                )
+                chunks = []
+                for chunk in stream:
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        chunks.append(delta)
+                        if stream_callback:
+                            stream_callback(delta)
+                text = "".join(chunks)
+            else:
+                text = message.content
+
             return {
-                "text": response.choices[0].message.content.strip(),
+                "text": text.strip(),
                 "tool_used": func_name if func_name else "",
             }
-        
+
         except Exception as e:
             print(f"Error calling CBORG API: {e}")
             return None
\ No newline at end of file
@@ -1,147 +1,293 @@
 import os
 import json
-import re
 import time
-from datetime import datetime
+import asyncio
+import logging
 from typing import Dict, List, Optional
-from atproto import Client, models
-from atproto.xrpc_client.models.app.bsky.feed.post import Main
+from tools.utils import sanitize_title
+
+logger = logging.getLogger(__name__)
+
+# Display placeholder for legacy log entries without a DOI line. It must
+# never reach the posted set: it is truthy, so one DOI-less paper would
+# otherwise mark every later DOI-less paper as already posted.
+_UNKNOWN_DOI = "Unknown DOI"
+
+class _RateLimiter:
+    """Token-bucket rate limiter for async callers.
+
+    Tokens refill continuously, so short bursts are allowed while the
+    average stays at max_rate events per time_period seconds — unlike a
+    fixed sleep, time spent inside the HTTP call counts toward the budget.
+    """
+
+    def __init__(self, max_rate: int, time_period: float = 60.0):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._tokens = float(max_rate)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.max_rate,
+                    self._tokens + (now - self._updated) * self.max_rate / self.time_period
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * self.time_period / self.max_rate)
+
 
 class BlueskyPoster:
-    def __init__(self, summary_file: str = "summary_output.log"):
+    def __init__(self, summary_file: Optional[str] = None, image_dir: str = "paper_images"):
+        if summary_file is None:
+            # Prefer the structured JSONL twin written by the summarizer;
+            # installs that predate it fall back to the legacy block log
+            summary_file = ("summaries.jsonl" if os.path.exists("summaries.jsonl")
+                            else "summary_output.log")
         self.summary_file = summary_file
+        self.image_dir = image_dir
         self.client = None
+        # title -> prompt filepath, loaded lazily from the generator's index
+        self._prompt_index = None
+        # DOIs already posted, persisted so re-runs skip whole papers
+        self.posted_file = 'posted.json'
+        self.posted = set()
+        if os.path.exists(self.posted_file):
+            try:
+                with open(self.posted_file, 'r') as f:
+                    # Drop the placeholder if an older run persisted it
+                    self.posted = set(json.load(f)) - {_UNKNOWN_DOI}
+            except Exception as e:
+                logger.warning("Could not load posted DOIs: %s", e)
+
+    def _save_posted(self):
+        """Flush the posted-DOI set to disk"""
+        try:
+            with open(self.posted_file, 'w') as f:
+                json.dump(sorted(self.posted), f)
+        except Exception as e:
+            logger.warning("Could not save posted DOIs: %s", e)
         
-    def authenticate(self, username: str, password: str):
+    # Lazily-built ATProto client shared by every instance, so a second
+    # poster reuses the existing session instead of re-running the login
+    # handshake
+    _shared_client = None
+
+    async def authenticate(self, username: str, password: str):
         """Authenticate with Bluesky"""
         try:
-            self.client = Client()
-            self.client.login(username, password)
-            print("Successfully authenticated with Bluesky")
+            # Imported here so callers that only extract summaries skip
+            # atproto's heavy import graph (pydantic, httpx, websockets)
+            from atproto import AsyncClient
+
+            if type(self)._shared_client is None:
+                type(self)._shared_client = AsyncClient()
+            self.client = type(self)._shared_client
+            if getattr(self.client, 'me', None) is None:
+                await self.client.login(username, password)
+            logger.info("Successfully authenticated with Bluesky")
             return True
         except Exception as e:
-            print(f"Authentication failed: {e}")
+            logger.error("Authentication failed: %s", e)
             return False
             
+    def _flush_entry(self, entry: Dict, summary_lines: List[str], summaries: List[Dict]):
+        """Emit a buffered log entry if it carried a summary"""
+        summary = '\n'.join(summary_lines).strip()
+        if summary:
+            summaries.append({
+                'title': entry.get('title', "Unknown Title"),
+                'doi': entry.get('doi', _UNKNOWN_DOI),
+                'authors': entry.get('authors', "Unknown Authors"),
+                'summary': summary
+            })
+
     def extract_summaries_from_log(self) -> List[Dict]:
-        """Extract paper summaries from the log file"""
+        """Extract paper summaries from the summary file.
+
+        A .jsonl file (as written by the summarizer) is parsed one JSON
+        object per line. The legacy block-delimited log is streamed line by
+        line, buffering only the current entry, so memory stays bounded no
+        matter how large the log grows.
+        """
         summaries = []
-        
+
+        if self.summary_file.endswith('.jsonl'):
+            try:
+                with open(self.summary_file, 'r') as f:
+                    return [json.loads(line) for line in f if line.strip()]
+            except Exception as e:
+                logger.error("Error reading summaries from JSONL file: %s", e)
+                return []
+
         try:
+            entry = {}
+            summary_lines = []
+            in_summary = False
+
             with open(self.summary_file, 'r') as f:
-                content = f.read()
-                
-            # Split content by paper entries
-            paper_entries = content.split("="*50)
-            
-            for entry in paper_entries:
-                if not entry.strip():
-                    continue
-                    
-                # Extract title
-                title_match = re.search(r'Title: (.*?)(?:\n|$)', entry)
-                title = title_match.group(1).strip() if title_match else "Unknown Title"
-                
-                # Extract DOI
-                doi_match = re.search(r'DOI: (.*?)(?:\n|$)', entry)
-                doi = doi_match.group(1).strip() if doi_match else "Unknown DOI"
-                
-                # Extract authors
-                authors_match = re.search(r'Authors: (.*?)(?:\n|$)', entry)
-                authors = authors_match.group(1).strip() if authors_match else "Unknown Authors"
-                
-                # Extract summary - look for the Summary: section
-                summary_match = re.search(r'Summary:\n(.*?)(?:\n\n|$)', entry, re.DOTALL)
-                summary = summary_match.group(1).strip() if summary_match else ""
-                
-                if summary:
-                    summaries.append({
-                        'title': title,
-                        'doi': doi,
-                        'authors': authors,
-                        'summary': summary
-                    })
-                    
+                for line in f:
+                    line = line.rstrip('\n')
+                    if line.startswith("=" * 50):
+                        # Entry boundary: emit what we have and reset
+                        self._flush_entry(entry, summary_lines, summaries)
+                        entry = {}
+                        summary_lines = []
+                        in_summary = False
+                    elif in_summary:
+                        if not line and summary_lines:
+                            # The summary section ends at the first blank line
+                            in_summary = False
+                        else:
+                            summary_lines.append(line)
+                    elif line.startswith('Title: '):
+                        entry['title'] = line[7:].strip()
+                    elif line.startswith('DOI: '):
+                        entry['doi'] = line[5:].strip()
+                    elif line.startswith('Authors: '):
+                        entry['authors'] = line[9:].strip()
+                    elif line == 'Summary:':
+                        in_summary = True
+
+            # Emit a trailing entry with no closing separator
+            self._flush_entry(entry, summary_lines, summaries)
+
             return summaries
-            
+
         except Exception as e:
-            print(f"Error extracting summaries from log file: {e}")
+            logger.error("Error extracting summaries from log file: %s", e)
             return []
             
+    def _load_prompt_index(self) -> Dict[str, str]:
+        """Load the title -> filepath index written by the image generator"""
+        index = {}
+        try:
+            with open(os.path.join(self.image_dir, 'index.jsonl'), 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    index[entry.get('title', '')] = entry.get('filepath', '')
+        except FileNotFoundError:
+            pass
+        return index
+
+    def find_image_prompt(self, title: str) -> Optional[str]:
+        """Find the generated image-prompt file for a paper title.
+
+        Uses the index written at generation time, so each lookup is a dict
+        hit; titles generated before the index existed fall back to the
+        derived filename.
+        """
+        if self._prompt_index is None:
+            self._prompt_index = self._load_prompt_index()
+
+        path = self._prompt_index.get(title)
+        if path:
+            return path
+
+        candidate = os.path.join(self.image_dir, f"{sanitize_title(title)[:50]}.txt")
+        return candidate if os.path.exists(candidate) else None
+
     def format_post_content(self, paper: Dict) -> str:
         """Format the paper summary for posting to Bluesky"""
-        title = paper['title']
-        doi = paper['doi']
-        authors = paper['authors']
-        summary = paper['summary']
-        
-        # Format the post content
-        post_content = f"📚 New Paper Alert: {title}\n\n"
-        post_content += f"👥 Authors: {authors}\n\n"
-        post_content += f"🔍 Summary:\n{summary}\n\n"
-        post_content += f"🔗 DOI: {doi}\n\n"
-        post_content += "#Science #Research #Academic"
+        # Single f-string: one allocation per post instead of one per +=
+        return (f"📚 New Paper Alert: {paper['title']}\n\n"
+                f"👥 Authors: {paper['authors']}\n\n"
+                f"🔍 Summary:\n{paper['summary']}\n\n"
+                f"🔗 DOI: {paper['doi']}\n\n"
+                "#Science #Research #Academic")
         
-        return post_content
-        
-    def post_to_bluesky(self, content: str) -> bool:
-        """Post content to Bluesky"""
-        try:
-            if not self.client:
-                print("Not authenticated with Bluesky. Please authenticate first.")
-                return False
-                
-            # Create the post
-            post = Main(
-                text=content,
-                created_at=datetime.now().isoformat()
-            )
-            
-            # Send the post
-            response = self.client.send_post(post)
-            print(f"Successfully posted to Bluesky: {response.uri}")
-            return True
-            
-        except Exception as e:
-            print(f"Error posting to Bluesky: {e}")
+    async def post_to_bluesky(self, content: str) -> bool:
+        """Post content to Bluesky, backing off and retrying on transient failures"""
+        if not self.client:
+            logger.error("Not authenticated with Bluesky. Please authenticate first.")
             return False
-            
-    def process_summaries(self, username: str, password: str, delay: int = 60):
-        """Process all summaries and post them to Bluesky"""
+
+        for attempt in range(3):
+            try:
+                # Send the post; the SDK builds the record and a well-formed
+                # createdAt itself
+                response = await self.client.send_post(text=content)
+                logger.info("Successfully posted to Bluesky: %s", response.uri)
+                return True
+
+            except Exception as e:
+                if attempt < 2:
+                    # Exponential backoff; rate-limit responses land here too
+                    wait = 5 * 2 ** attempt
+                    logger.warning("Error posting to Bluesky (%s); retrying in %ds...", e, wait)
+                    await asyncio.sleep(wait)
+                else:
+                    logger.error("Error posting to Bluesky: %s", e)
+
+        return False
+
+    async def _post_one(self, paper: Dict, index: int, total: int,
+                        sem: asyncio.Semaphore, limiter: _RateLimiter):
+        """Post one summary, bounded by the semaphore and the rate limiter"""
+        async with sem:
+            await limiter.acquire()
+            logger.info("Processing paper %d/%d: %s", index, total, paper['title'])
+
+            post_content = self.format_post_content(paper)
+            success = await self.post_to_bluesky(post_content)
+
+            if success:
+                logger.info("Successfully posted summary for: %s", paper['title'])
+                doi = paper.get('doi')
+                if doi and doi != _UNKNOWN_DOI:
+                    self.posted.add(doi)
+                    self._save_posted()
+            else:
+                logger.error("Failed to post summary for: %s", paper['title'])
+
+    async def process_summaries(self, username: str, password: str, post_rate: int = 30):
+        """Process all summaries and post them to Bluesky.
+
+        Posts are pipelined through a small semaphore, with a token-bucket
+        limiter holding the average to post_rate posts per minute, so wall
+        time scales with the rate budget rather than the number of papers.
+        """
         # Authenticate with Bluesky
-        if not self.authenticate(username, password):
+        if not await self.authenticate(username, password):
             return
-            
+
         # Extract summaries from the log file
         summaries = self.extract_summaries_from_log()
-        
+
         if not summaries:
-            print("No summaries found in the log file")
+            logger.warning("No summaries found in the log file")
             return
-            
-        print(f"Found {len(summaries)} summaries to post")
-        
-        # Post each summary
-        for i, paper in enumerate(summaries):
-            print(f"\nProcessing paper {i+1}/{len(summaries)}: {paper['title']}")
-            
-            # Format the post content
-            post_content = self.format_post_content(paper)
-            
-            # Post to Bluesky
-            success = self.post_to_bluesky(post_content)
-            
-            if success:
-                print(f"Successfully posted summary for: {paper['title']}")
-            else:
-                print(f"Failed to post summary for: {paper['title']}")
-                
-            # Add a delay between posts to avoid rate limiting
-            if i < len(summaries) - 1:  # Don't delay after the last post
-                print(f"Waiting {delay} seconds before next post...")
-                time.sleep(delay)
-                
+
+        # Skip papers posted on previous runs
+        already_posted = [p for p in summaries if p.get('doi') in self.posted]
+        if already_posted:
+            logger.info("Skipping %d already-posted papers", len(already_posted))
+            summaries = [p for p in summaries if p.get('doi') not in self.posted]
+
+        if not summaries:
+            logger.info("All summaries have already been posted")
+            return
+
+        logger.info("Found %d summaries to post", len(summaries))
+
+        sem = asyncio.Semaphore(2)
+        limiter = _RateLimiter(max_rate=post_rate, time_period=60.0)
+        await asyncio.gather(*(
+            self._post_one(paper, i + 1, len(summaries), sem, limiter)
+            for i, paper in enumerate(summaries)
+        ))
+
 def main():
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
     # Get Bluesky credentials from environment variables or prompt the user
     username = os.environ.get('BLUESKY_USERNAME')
     password = os.environ.get('BLUESKY_PASSWORD')
@@ -151,7 +297,7 @@ def main():
         password = input("Enter your Bluesky password: ")
         
     poster = BlueskyPoster()
-    poster.process_summaries(username, password)
+    asyncio.run(poster.process_summaries(username, password))
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,85 @@
+import os
+import json
+import time
+import logging
+import tempfile
+from typing import Dict, List
+from openai import OpenAI
+
+try:
+    from tools.nelli_http import shared_http
+except ImportError:  # Running from inside tools/
+    from nelli_http import shared_http
+
+# Initialize OpenAI with LBL specifics
+client = OpenAI(
+    api_key=os.environ.get('CBORG_API_KEY'),
+    base_url="https://api.cborg.lbl.gov",
+    http_client=shared_http
+)
+
+logger = logging.getLogger(__name__)
+
+def submit_batch(requests: List[Dict], poll_interval: int = 30) -> Dict[str, str]:
+    """Submit chat completion requests as one Batch API job and wait for the results.
+
+    Each entry in `requests` must have a 'custom_id' (we use the paper DOI) and a
+    'body' with the usual chat.completions arguments. Returns a dict mapping
+    custom_id -> completion text. One upload amortizes the per-request overhead
+    and avoids rate-limit stalls compared to firing the calls one at a time.
+    """
+    batch_file_path = None
+    try:
+        # Write the requests as a JSONL file for upload
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.jsonl', delete=False) as f:
+            for request in requests:
+                f.write(json.dumps({
+                    "custom_id": request["custom_id"],
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": request["body"]
+                }) + "\n")
+            batch_file_path = f.name
+
+        # Upload the file and create the batch job
+        with open(batch_file_path, 'rb') as f:
+            batch_file = client.files.create(file=f, purpose="batch")
+
+        batch = client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        logger.info("Submitted batch %s with %d requests", batch.id, len(requests))
+
+        # Poll until the batch finishes
+        while True:
+            batch = client.batches.retrieve(batch.id)
+            if batch.status == "completed":
+                break
+            if batch.status in ("failed", "expired", "cancelled"):
+                logger.error("Batch %s ended with status: %s", batch.id, batch.status)
+                return {}
+            logger.info("Batch %s status: %s, waiting %ds...", batch.id, batch.status, poll_interval)
+            time.sleep(poll_interval)
+
+        # Download and match results back by custom_id
+        results = {}
+        output = client.files.content(batch.output_file_id)
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            response_body = entry.get("response", {}).get("body", {})
+            choices = response_body.get("choices", [])
+            if choices:
+                results[entry["custom_id"]] = choices[0]["message"]["content"].strip()
+
+        return results
+
+    except Exception as e:
+        logger.error("Error submitting batch: %s", e)
+        return {}
+    finally:
+        if batch_file_path and os.path.exists(batch_file_path):
+            os.remove(batch_file_path)
@@ -1,56 +1,127 @@
 import os
+import gzip
+import logging
 import numpy as np
-import requests
+import httpx
 import json
 from datetime import datetime, timedelta
+
+try:
+    # orjson parses the multi-KB collection payloads several times faster
+    import orjson
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
 from typing import List, Dict, Optional
 import time
 import asyncio
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from tools.nelli_http import shared_http, shared_async_http
+except ImportError:  # Running from inside tools/
+    from nelli_http import shared_http, shared_async_http
+
+
+logger = logging.getLogger(__name__)
 
+# On-disk cache of date-range responses; past windows never change, so
+# daily re-runs read from disk instead of re-fetching the cursor sweep
+_CACHE_DIR = '.biorxiv_cache'
+
+
+def _normalize_name(name: str) -> str:
+    """Lowercase and strip diacritics so e.g. 'Muñoz' matches 'Munoz'"""
+    return unicodedata.normalize('NFD', name.lower()).encode('ascii', 'ignore').decode()
 
 
 class BiorxivAgent:
-    def __init__(self, base_url: str = "https://api.biorxiv.org", log_file: str = "paper_notifications.log"):
+    def __init__(self, base_url: str = "https://api.biorxiv.org", log_file: str = "paper_notifications.log",
+                 http_client=None):
         self.base_url = base_url
         self.authors_of_interest = set()
         self.log_file = log_file
+        self.async_http = http_client or shared_async_http
+        # Sync paths share the process-wide HTTP/2 client: one TLS session,
+        # multiplexed streams instead of head-of-line-blocked HTTP/1.1
+        self.sync_http = shared_http
+        # Titles already in the log, kept in memory so each notification call
+        # does not re-scan the whole file
+        self._existing_titles = self._load_existing_titles()
+
+    def _load_existing_titles(self) -> set:
+        """Stream the log once for the titles already written"""
+        try:
+            with open(self.log_file, 'r') as f:
+                return {line[7:].strip() for line in f if line.startswith('Title: ')}
+        except FileNotFoundError:
+            return set()
         
     def add_author_of_interest(self, author: str):
         self.authors_of_interest.add(author)
+
+    def add_authors_of_interest(self, authors):
+        """Add a batch of authors in one call; the set skips duplicates"""
+        self.authors_of_interest.update(authors)
         
-    def get_papers_by_date_range(self, start_date: str, end_date: str, 
+    def get_papers_by_date_range(self, start_date: str, end_date: str,
                                 server: str = "biorxiv", cursor: int = 0) -> Dict:
+        cache_path = os.path.join(_CACHE_DIR, f"{server}_{start_date}_{end_date}_{cursor}.json.gz")
+        # Windows that include today can still gain papers: 1-hour TTL.
+        # Fully past windows are immutable: cache forever.
+        ttl = 3600 if end_date >= datetime.now().strftime('%Y-%m-%d') else None
+        try:
+            age = time.time() - os.path.getmtime(cache_path)
+            if ttl is None or age < ttl:
+                with gzip.open(cache_path, 'rt') as f:
+                    return _json_loads(f.read())
+        except OSError:
+            pass  # No usable cache entry; fall through to the network
+
         try:
             endpoint = f"{self.base_url}/details/{server}/{start_date}/{end_date}/{cursor}"
-            print(f"Fetching papers from endpoint: {endpoint}")  # Debug print
-            response = requests.get(endpoint)
+            logger.debug("Fetching papers from endpoint: %s", endpoint)
+            response = self.sync_http.get(endpoint, timeout=30)
             response.raise_for_status()  # Raise an exception for bad status codes
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching papers: {e}")
+            data = _json_loads(response.content)
+        except httpx.HTTPError as e:
+            logger.error("Error fetching papers: %s", e)
             return {"collection": []}
 
+        try:
+            os.makedirs(_CACHE_DIR, exist_ok=True)
+            with gzip.open(cache_path, 'wt') as f:
+                f.write(_json_dumps(data))
+        except OSError as e:
+            logger.warning("Could not write biorxiv cache: %s", e)
+        return data
+
     def get_paper_by_doi(self, doi: str, server: str = "biorxiv") -> Dict:
         try:
             endpoint = f"{self.base_url}/details/{server}/{doi}/na/json"
-            response = requests.get(endpoint)
+            response = self.sync_http.get(endpoint, timeout=30)
             response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching paper by DOI: {e}")
+            return _json_loads(response.content)
+        except httpx.HTTPError as e:
+            logger.error("Error fetching paper by DOI: %s", e)
             return {}
 
     def filter_papers_by_authors(self, papers_data: Dict) -> List[Dict]:
         filtered_papers = []
         collection = papers_data.get('collection', [])
-        print(f"Total papers to filter: {len(collection)}")  # Debug print
-        
+        logger.debug("Total papers to filter: %d", len(collection))
+
         for paper in collection:
             authors = paper.get('authors', '').split('; ')
             if any(author in self.authors_of_interest for author in authors):
                 filtered_papers.append(paper)
         
-        print(f"Found {len(filtered_papers)} papers by authors of interest")  # Debug print
+        logger.debug("Found %d papers by authors of interest", len(filtered_papers))
         return filtered_papers
 
     def process_new_papers(self, days_back: int = 1):
@@ -60,14 +131,14 @@ class BiorxivAgent:
         end_date = datetime.now().strftime('%Y-%m-%d')
         start_date = (datetime.now() - timedelta(days=days_back)).strftime('%Y-%m-%d')
         
-        print(f"Searching for papers between {start_date} and {end_date}")  # Debug print
+        logger.debug("Searching for papers between %s and %s", start_date, end_date)
         
         papers_data = self.get_papers_by_date_range(start_date, end_date)
         filtered_papers = self.filter_papers_by_authors(papers_data)
         
         processed_papers = []
         for paper in filtered_papers:
-            print(f"Processing paper: {paper.get('title', 'No title')}")  # Debug print
+            logger.debug("Processing paper: %s", paper.get('title', 'No title'))
             summary = self.generate_summary(paper.get('abstract', ''))
             if summary:
                 processed_papers.append({
@@ -89,112 +160,157 @@ class BiorxivAgent:
             return
             
         try:
-            # Read existing log file to check for already logged titles
-            existing_titles = set()
-            if os.path.exists(self.log_file):
-                with open(self.log_file, 'r') as f:
-                    content = f.read()
-                    # Extract titles from the log file
-                    for line in content.split('\n'):
-                        if line.startswith('Title: '):
-                            existing_titles.add(line[7:].strip())
-            
-            # Filter out papers that have already been logged
-            new_papers = [paper for paper in papers if paper['title'] not in existing_titles]
+            # Filter out papers that have already been logged, using the
+            # in-memory title set instead of re-reading the log
+            new_papers = [paper for paper in papers if paper['title'] not in self._existing_titles]
             
             if not new_papers:
-                print("No new papers to log - all titles already exist in the log file")
+                logger.info("No new papers to log - all titles already exist in the log file")
                 return
                 
             timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            # Assemble the whole entry in memory and write it with one syscall
+            lines = [f"\n\n=== New Papers Found at {timestamp} ===\n"]
+            for paper in new_papers:
+                lines.append("\n" + "="*50 + "\n")
+                lines.append(f"Title: {paper['title']}\n")
+                lines.append("Matching Authors:\n")
+                for author in paper['matching_authors']:
+                    lines.append(f"  - {author['name']} ({author['affiliation']})\n")
+                lines.append(f"Date: {paper['date']}\n")
+                lines.append(f"DOI: {paper['doi']}\n")
+                lines.append("="*50 + "\n")
+
             with open(self.log_file, 'a') as f:
-                f.write(f"\n\n=== New Papers Found at {timestamp} ===\n")
-                for paper in new_papers:
-                    f.write("\n" + "="*50 + "\n")
-                    f.write(f"Title: {paper['title']}\n")
-                    f.write("Matching Authors:\n")
-                    for author in paper['matching_authors']:
-                        f.write(f"  - {author['name']} ({author['affiliation']})\n")
-                    f.write(f"Date: {paper['date']}\n")
-                    f.write(f"DOI: {paper['doi']}\n")
-                    f.write("="*50 + "\n")
-                
-            print(f"Logged {len(new_papers)} new papers to {self.log_file}")
-            
+                f.write(''.join(lines))
+
+            self._existing_titles.update(paper['title'] for paper in new_papers)
+
+            logger.info("Logged %d new papers to %s", len(new_papers), self.log_file)
+
         except Exception as e:
-            print(f"Failed to log paper notifications: {e}")
+            logger.error("Failed to log paper notifications: %s", e)
+
+    def _match_collection(self, collection: List[Dict], normalized_targets: List[str], found_papers: Dict):
+        """Filter one page of papers against the target authors, adding matches to found_papers"""
+        # Exact matches are an O(1) hash lookup; only targets long enough for
+        # the strict partial check need per-author substring tests
+        target_set = frozenset(normalized_targets)
+        partial_targets = [t for t in normalized_targets if len(t) > 5]
+
+        for paper in collection:
+            # Cheap pre-filter: most papers carry no target author, so skip
+            # the split and affiliation-mapping work unless some target shows
+            # up in the raw authors string at all
+            raw_authors = paper.get('authors', '')
+            normalized_raw = _normalize_name(raw_authors)
+            if not any(target in normalized_raw for target in normalized_targets):
+                continue
+
+            authors = [a.strip() for a in raw_authors.split(';')]
+            affiliations = [a.strip() for a in paper.get('affiliations', '').split(';')]
+            # Pad so authors and affiliations zip positionally; no intermediate
+            # dict needed
+            affiliations += ["No affiliation listed"] * max(0, len(authors) - len(affiliations))
+
+            # Single pass: exact match first (hash lookup), then the stricter
+            # partial match
+            matching_authors = [
+                {'name': author, 'affiliation': affiliations[i]}
+                for i, author in enumerate(authors)
+                if (normalized := _normalize_name(author)) in target_set
+                or any(target in normalized for target in partial_targets)
+            ]
+
+            # If we found any matching authors, add the paper
+            if matching_authors:
+                doi = paper.get('doi')
+                if doi not in found_papers:  # Only add if we haven't seen this paper before
+                    found_papers[doi] = {
+                        'doi': doi,
+                        'title': paper.get('title'),
+                        'matching_authors': matching_authors,
+                        'date': paper.get('date')
+                    }
+
+    async def search_authors_with_cursor_async(self, start_date: str, end_date: str, target_authors: List[str], max_cursor: int = 145) -> List[Dict]:
+        """
+        Async variant of search_authors_with_cursor that fetches the cursor pages
+        concurrently, so total fetch time is bounded by the slowest page instead
+        of the sum of all round-trips.
+        """
+        found_papers = {}  # Using dict to track unique papers by DOI
+
+        logger.info("Searching for papers by authors: %s", ', '.join(target_authors))
+
+        # Normalize target authors for comparison
+        normalized_targets = [_normalize_name(target.strip()) for target in target_authors]
+
+        sem = asyncio.Semaphore(8)
+
+        async def fetch_cursor(cursor: int) -> Dict:
+            # Route through the cached sync fetch in a worker thread, so the
+            # async path reads and feeds the same on-disk date-range cache;
+            # a cache hit never touches the network
+            async with sem:
+                return await asyncio.to_thread(
+                    self.get_papers_by_date_range, start_date, end_date, cursor=cursor
+                )
+
+        pages = await asyncio.gather(*(fetch_cursor(c) for c in range(143, 146)))
+
+        for papers_data in pages:
+            collection = papers_data.get('collection', [])
+            if collection:
+                self._match_collection(collection, normalized_targets, found_papers)
+
+        results = list(found_papers.values())
+
+        # Log paper notifications if papers are found
+        if results:
+            self.log_paper_notification(results)
+
+        return results
 
     def search_authors_with_cursor(self, start_date: str, end_date: str, target_authors: List[str], max_cursor: int = 145) -> List[Dict]:
         """
         Search for papers by specific authors using cursor pagination.
         Returns papers that match any of the target authors, showing all matching authors for each paper.
+        Fetches the cursor pages in a thread pool, so the sync path gets the
+        same overlap as the async variant while staying safe to call from code
+        that is already inside a running event loop (asyncio.run would raise).
         """
         found_papers = {}  # Using dict to track unique papers by DOI
-        
-        print(f"\nSearching for papers by authors: {', '.join(target_authors)}")
-        
+
+        logger.info("Searching for papers by authors: %s", ', '.join(target_authors))
+
         # Normalize target authors for comparison
-        normalized_targets = [target.strip().lower() for target in target_authors]
-        
-        for cursor in range(143, 146):
-            papers_data = self.get_papers_by_date_range(start_date, end_date, cursor=cursor)
+        normalized_targets = [_normalize_name(target.strip()) for target in target_authors]
+
+        # The GIL releases during socket reads, so threaded GETs overlap;
+        # the shared httpx client is thread-safe
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            pages = list(executor.map(
+                lambda c: self.get_papers_by_date_range(start_date, end_date, cursor=c),
+                range(143, 146)
+            ))
+
+        # Filtering is CPU-cheap; do it serially over the fetched pages
+        for papers_data in pages:
             collection = papers_data.get('collection', [])
-            
-            if not collection:
-                break
-                
-            for paper in collection:
-                authors = paper.get('authors', '').split(';')
-                affiliations = paper.get('affiliations', '').split(';')
-                
-                # Create a mapping of authors to their affiliations
-                author_affiliations = {}
-                for i, author in enumerate(authors):
-                    if i < len(affiliations):
-                        author_affiliations[author.strip()] = affiliations[i].strip()
-                    else:
-                        author_affiliations[author.strip()] = "No affiliation listed"
-                
-                # Find all matching authors for this paper
-                matching_authors = []
-                for author in authors:
-                    author = author.strip()
-                    # Normalize author name for comparison
-                    normalized_author = author.lower()
-                    
-                    # Check for exact matches first
-                    if any(target == normalized_author for target in normalized_targets):
-                        matching_authors.append({
-                            'name': author,
-                            'affiliation': author_affiliations.get(author, "No affiliation listed")
-                        })
-                    # If no exact match, check for partial matches with more strict criteria
-                    elif any(target in normalized_author and len(target) > 5 for target in normalized_targets):
-                        matching_authors.append({
-                            'name': author,
-                            'affiliation': author_affiliations.get(author, "No affiliation listed")
-                        })
-                
-                # If we found any matching authors, add the paper
-                if matching_authors:
-                    doi = paper.get('doi')
-                    if doi not in found_papers:  # Only add if we haven't seen this paper before
-                        found_papers[doi] = {
-                            'doi': doi,
-                            'title': paper.get('title'),
-                            'matching_authors': matching_authors,
-                            'date': paper.get('date')
-                        }
-        
+            if collection:
+                self._match_collection(collection, normalized_targets, found_papers)
+
         results = list(found_papers.values())
-        
+
         # Log paper notifications if papers are found
         if results:
             self.log_paper_notification(results)
-            
+
         return results
 
 def main():
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
     agent = BiorxivAgent()
     
     # Define target authors as a list
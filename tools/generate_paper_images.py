@@ -1,39 +1,140 @@
 import os
 import json
+import logging
 import requests
+
+try:
+    # orjson parses the paper payloads several times faster
+    import orjson
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from openai import OpenAI
 from typing import Dict, List, Optional
 import time
 import re
+import asyncio
+import threading
+
+try:
+    from tools.nelli_http import shared_http, shared_async_http
+    from tools.utils import sanitize_title
+except ImportError:  # Running from inside tools/
+    from nelli_http import shared_http, shared_async_http
+    from utils import sanitize_title
+
+logger = logging.getLogger(__name__)
+
+# Compiled once at import instead of per call; anchored because DOI lines
+# in the notification log always start the line
+_DOI_RE = re.compile(r'^DOI: (10\.\d{4,9}/[-._;()/:\w]+)')
 
 class PaperImageGenerator:
-    def __init__(self, log_file: str = "paper_notifications.log", output_dir: str = "paper_images"):
+    # Lazily-built OpenAI client shared by every instance: the client owns an
+    # httpx connection pool, so constructing one per instance wastes setup
+    # time and TLS handshakes
+    _shared_client = None
+
+    def __init__(self, log_file: str = "paper_notifications.log", output_dir: str = "paper_images",
+                 http_client=None):
         self.log_file = log_file
         self.output_dir = output_dir
         self.base_url = "https://api.biorxiv.org"
-        self.client = OpenAI(
+        # An injected http_client gets a dedicated per-instance client;
+        # otherwise the class-level singleton is used
+        self._client = OpenAI(
             api_key=os.environ.get('CBORG_API_KEY'),
-            base_url="https://api.cborg.lbl.gov"
-        )
+            base_url="https://api.cborg.lbl.gov",
+            http_client=http_client
+        ) if http_client else None
         self.text_model = "lbl/cborg-chat:latest"  # For text generation
         self.image_model = "lbl/cborg-vision:latest"  # For image generation
+        # USE_LLM_PROMPT=0 builds image prompts from a local template instead
+        # of an LLM round-trip per paper
+        self.use_llm_prompt = bool(int(os.environ.get('USE_LLM_PROMPT', '1')))
+
+        # Keep-alive session for the sync biorxiv fetches
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': 'biorxiv-agent/1.0', 'Accept-Encoding': 'gzip'})
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=10, pool_maxsize=20,
+            max_retries=Retry(total=3, backoff_factor=0.5)
+        ))
         
         # Create output directory if it doesn't exist
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
+
+        # On-disk cache of DOI -> paper metadata and DOI -> generated prompt,
+        # so re-runs skip the network and LLM for papers already seen
+        self.cache_path = 'paper_cache.json'
+        self.cache = {'papers': {}, 'prompts': {}}
+        # Serializes the truncate-and-write below: prompt generation runs in
+        # worker threads while fetches save from the event-loop thread, and
+        # two interleaved writers would corrupt the file
+        self._cache_lock = threading.Lock()
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, 'r') as f:
+                    loaded = _json_loads(f.read())
+                self.cache['papers'] = loaded.get('papers', {})
+                self.cache['prompts'] = loaded.get('prompts', {})
+            except Exception as e:
+                logger.warning("Could not load paper cache: %s", e)
+
+    @property
+    def client(self) -> OpenAI:
+        """OpenAI client, initialized on first use and shared across instances"""
+        if self._client is not None:
+            return self._client
+        if type(self)._shared_client is None:
+            type(self)._shared_client = OpenAI(
+                api_key=os.environ.get('CBORG_API_KEY'),
+                base_url="https://api.cborg.lbl.gov",
+                http_client=shared_http
+            )
+        return type(self)._shared_client
+
+    def _save_cache(self):
+        """Flush the DOI cache to disk"""
+        try:
+            with self._cache_lock:
+                with open(self.cache_path, 'w') as f:
+                    f.write(_json_dumps(self.cache))
+        except Exception as e:
+            logger.warning("Could not save paper cache: %s", e)
             
-    def get_paper_by_doi(self, doi: str, server: str = "biorxiv") -> Dict:
-        """Fetch paper data from biorxiv using DOI"""
+    def get_paper_by_doi(self, doi: str, server: str = "biorxiv", fetch_fulltext: bool = False) -> Dict:
+        """Fetch paper data from biorxiv using DOI.
+
+        The JATS XML (often hundreds of KB) is only downloaded when
+        fetch_fulltext is set; the image-prompt path needs just the title
+        and abstract.
+        """
+        # The flag is part of the cache key, so a fetch_fulltext call never
+        # gets served a record that was cached without its full_text
+        cache_key = f"{doi}/full" if fetch_fulltext else doi
+        if cache_key in self.cache['papers']:
+            return self.cache['papers'][cache_key]
+
         try:
             # First get the paper details
             details_endpoint = f"{self.base_url}/details/{server}/{doi}/na/json"
-            print(f"Fetching paper details from: {details_endpoint}")
-            details_response = requests.get(details_endpoint)
+            logger.debug("Fetching paper details from: %s", details_endpoint)
+            details_response = self.session.get(details_endpoint, timeout=(5, 30))
             details_response.raise_for_status()
-            paper_details = details_response.json()
-            
-            print(f"Paper details response: {json.dumps(paper_details, indent=2)}")
+            paper_details = _json_loads(details_response.content)
             
+            # %s formatting is deferred: the payload is only stringified when
+            # DEBUG is actually enabled, so production runs skip the pretty-print
+            logger.debug("Paper details response: %s", paper_details)
+
             # Extract data from the collection
             if 'collection' in paper_details and paper_details['collection']:
                 paper_info = paper_details['collection'][0]
@@ -48,34 +149,100 @@ class PaperImageGenerator:
                     'category': paper_info.get('category', '')
                 }
                 
-                # Try to get the full text if available
-                if 'jatsxml' in paper_info:
+                # Try to get the full text if explicitly requested
+                if fetch_fulltext and 'jatsxml' in paper_info:
                     try:
                         xml_url = paper_info['jatsxml']
-                        print(f"Fetching XML content from: {xml_url}")
-                        xml_response = requests.get(xml_url)
+                        logger.debug("Fetching XML content from: %s", xml_url)
+                        xml_response = self.session.get(xml_url, timeout=(5, 30))
                         xml_response.raise_for_status()
                         extracted_data['full_text'] = xml_response.text
                     except Exception as e:
-                        print(f"Could not fetch XML content: {e}")
+                        logger.warning("Could not fetch XML content: %s", e)
                         extracted_data['full_text'] = ''
-                
+
+                self.cache['papers'][cache_key] = extracted_data
+                self._save_cache()
                 return extracted_data
             else:
-                print("No collection found in paper details")
+                logger.warning("No collection found in paper details")
                 return {}
                 
         except requests.exceptions.RequestException as e:
-            print(f"Error fetching paper by DOI: {e}")
+            logger.error("Error fetching paper by DOI: %s", e)
             if hasattr(e.response, 'text'):
-                print(f"Response text: {e.response.text}")
+                logger.debug("Response text: %s", e.response.text)
             return {}
         except Exception as e:
-            print(f"Unexpected error: {e}")
+            logger.error("Unexpected error: %s", e)
             return {}
             
+    async def _get_paper_by_doi_async(self, doi: str, server: str = "biorxiv",
+                                      fetch_fulltext: bool = False) -> Dict:
+        """Async counterpart of get_paper_by_doi, using the shared connection pool"""
+        cache_key = f"{doi}/full" if fetch_fulltext else doi
+        if cache_key in self.cache['papers']:
+            return self.cache['papers'][cache_key]
+
+        try:
+            details_endpoint = f"{self.base_url}/details/{server}/{doi}/na/json"
+            logger.debug("Fetching paper details from: %s", details_endpoint)
+            details_response = await shared_async_http.get(details_endpoint)
+            details_response.raise_for_status()
+            paper_details = _json_loads(details_response.content)
+
+            if 'collection' in paper_details and paper_details['collection']:
+                paper_info = paper_details['collection'][0]
+
+                extracted_data = {
+                    'title': paper_info.get('title', ''),
+                    'abstract': paper_info.get('abstract', ''),
+                    'authors': paper_info.get('authors', ''),
+                    'doi': paper_info.get('doi', ''),
+                    'date': paper_info.get('date', ''),
+                    'category': paper_info.get('category', '')
+                }
+
+                # Try to get the full text if explicitly requested
+                if fetch_fulltext and 'jatsxml' in paper_info:
+                    try:
+                        xml_url = paper_info['jatsxml']
+                        logger.debug("Fetching XML content from: %s", xml_url)
+                        xml_response = await shared_async_http.get(xml_url)
+                        xml_response.raise_for_status()
+                        extracted_data['full_text'] = xml_response.text
+                    except Exception as e:
+                        logger.warning("Could not fetch XML content: %s", e)
+                        extracted_data['full_text'] = ''
+
+                self.cache['papers'][cache_key] = extracted_data
+                self._save_cache()
+                return extracted_data
+            else:
+                logger.warning("No collection found in paper details")
+                return {}
+
+        except Exception as e:
+            logger.error("Error fetching paper by DOI: %s", e)
+            return {}
+
+    def _template_prompt(self, paper_data: Dict) -> str:
+        """Build an image prompt locally, without an LLM call"""
+        title = paper_data.get('title', '')
+        abstract = paper_data.get('abstract', '')
+        return (f"A scientific illustration representing: {title}. "
+                f"Visual style: clean infographic. "
+                f"Key concepts from abstract: {abstract[:400]}.")
+
     def generate_image_prompt(self, paper_data: Dict) -> str:
         """Generate a prompt for image generation based on the paper data"""
+        if not self.use_llm_prompt:
+            return self._template_prompt(paper_data)
+
+        doi = paper_data.get('doi', '')
+        if doi and doi in self.cache['prompts']:
+            return self.cache['prompts'][doi]
+
         try:
             title = paper_data.get('title', '')
             abstract = paper_data.get('abstract', '')
@@ -96,22 +263,83 @@ Create a simple yet graphically pleasing image generation prompt that captures t
                 ]
             )
             
-            return response.choices[0].message.content.strip()
-            
+            image_prompt = response.choices[0].message.content.strip()
+            if doi:
+                self.cache['prompts'][doi] = image_prompt
+                self._save_cache()
+            return image_prompt
+
         except Exception as e:
-            print(f"Error generating image prompt: {e}")
+            logger.error("Error generating image prompt: %s", e)
             return f"Scientific illustration of {paper_data.get('title', 'Unknown Title')}"
 
+    def generate_image_prompts_batch(self, papers: List[Dict]) -> List[str]:
+        """Generate image prompts for several papers with a single LLM call.
+
+        Papers whose prompt is already cached are filled in locally; the
+        rest go out as one request, so N new papers cost one round-trip
+        instead of N.
+        """
+        if not papers:
+            return []
+        if not self.use_llm_prompt:
+            return [self._template_prompt(p) for p in papers]
+
+        uncached = [p for p in papers if p.get('doi', '') not in self.cache['prompts']]
+        if uncached:
+            for p, prompt in zip(uncached, self._request_prompts_batch(uncached)):
+                doi = p.get('doi', '')
+                if doi:
+                    self.cache['prompts'][doi] = prompt
+            self._save_cache()
+
+        return [self.cache['prompts'].get(p.get('doi', '')) or self.generate_image_prompt(p)
+                for p in papers]
+
+    def _request_prompts_batch(self, papers: List[Dict]) -> List[str]:
+        """One LLM request covering every paper, asking for a JSON list of
+        prompts. Falls back to per-paper calls if the response cannot be
+        parsed."""
+        try:
+            numbered = "\n\n".join(
+                f"{i}. TITLE: {p.get('title', '')}\nABSTRACT: {p.get('abstract', '')}"
+                for i, p in enumerate(papers, 1)
+            )
+            prompt = (
+                f"For each of the following {len(papers)} scientific papers, create a simple yet "
+                "graphically pleasing image generation prompt that captures the essence of the paper. "
+                f"Return ONLY a JSON list of {len(papers)} strings, one prompt per paper, in order.\n\n"
+                f"{numbered}"
+            )
+
+            response = self.client.chat.completions.create(
+                model=self.text_model,
+                messages=[
+                    {"role": "system", "content": "You are an expert at creating detailed image generation prompts for scientific papers. Your prompts should be specific, descriptive, and focus on the visual elements that best represent each paper's main findings."},
+                    {"role": "user", "content": prompt}
+                ]
+            )
+
+            response_text = response.choices[0].message.content.strip()
+            response_text = response_text.replace('```json', '').replace('```', '').strip()
+            prompts = _json_loads(response_text)
+            if isinstance(prompts, list) and len(prompts) == len(papers):
+                return [str(p) for p in prompts]
+            logger.warning("Batch prompt response did not match the paper count; falling back")
+        except Exception as e:
+            logger.error("Error generating image prompts in batch: %s", e)
+
+        return [self.generate_image_prompt(p) for p in papers]
+
     def generate_image(self, prompt: str, title: str) -> Optional[str]:
         """Generate an image using the vision model"""
         try:
             # Create a safe filename from the title
-            safe_title = re.sub(r'[^\w\s-]', '', title)
-            safe_title = re.sub(r'[-\s]+', '_', safe_title).strip('-_')
+            safe_title = sanitize_title(title)
             image_path = os.path.join(self.output_dir, f"{safe_title[:50]}.png")
             
-            print(f"Generating image for: {title}")
-            print(f"Using prompt: {prompt}")
+            logger.info("Generating image for: %s", title)
+            logger.debug("Using prompt: %s", prompt)
             
             # Comment out the actual image generation code
             """
@@ -137,62 +365,82 @@ Create a simple yet graphically pleasing image generation prompt that captures t
             """
             
             # Instead, just save the prompt to a text file
-            with open(image_path.replace('.png', '.txt'), 'w') as f:
+            prompt_path = image_path.replace('.png', '.txt')
+            with open(prompt_path, 'w') as f:
                 f.write(f"Image prompt for: {title}\n\n{prompt}")
-                
-            print(f"Prompt saved to: {image_path.replace('.png', '.txt')}")
-            return image_path.replace('.png', '.txt')
-            
+
+            # Record title -> filepath so consumers can look prompts up
+            # without re-deriving the filename
+            with open(os.path.join(self.output_dir, 'index.jsonl'), 'a') as idx:
+                idx.write(_json_dumps({'title': title, 'filepath': prompt_path}) + '\n')
+
+            logger.info("Prompt saved to: %s", prompt_path)
+            return prompt_path
+
         except Exception as e:
-            print(f"Error generating image: {e}")
+            logger.error("Error generating image: %s", e)
             return None
             
     def process_log_file(self):
         """Read DOIs from log file and generate images for each paper"""
         try:
+            # Stream line by line instead of materializing the whole log;
+            # re.match with the anchored pattern never scans line interiors
+            dois = []
             with open(self.log_file, 'r') as f:
-                content = f.read()
-                
-            # Extract DOIs using regex
-            doi_pattern = r'DOI: (10\.\d{4,9}/[-._;()/:\w]+)'
-            dois = re.findall(doi_pattern, content)
-            
+                for line in f:
+                    m = _DOI_RE.match(line)
+                    if m:
+                        dois.append(m.group(1))
+
+            # Dedup while preserving order; the same DOI can appear in
+            # multiple notification blocks
+            dois = list(dict.fromkeys(dois))
+
             if not dois:
-                print("No DOIs found in log file")
+                logger.warning("No DOIs found in log file")
                 return
-                
-            print(f"\nFound {len(dois)} papers to process")
-            
-            # Process each DOI
-            for doi in dois:
-                print(f"\nProcessing DOI: {doi}")
-                paper_data = self.get_paper_by_doi(doi)
-                
-                if paper_data:
-                    title = paper_data.get('title', 'No title')
-                    print(f"\nProcessing paper: {title}")
-                    
-                    # Generate image prompt
-                    image_prompt = self.generate_image_prompt(paper_data)
-                    print(f"Generated prompt: {image_prompt}")
-                    
-                    # Generate image
-                    image_path = self.generate_image(image_prompt, title)
-                    
-                    if image_path:
-                        print(f"Successfully generated image for: {title}")
+
+            logger.info("Found %d papers to process", len(dois))
+
+            # Fetch the papers concurrently (at most 8 requests in flight
+            # against biorxiv), then generate every prompt in one batched
+            # LLM call instead of one call per paper
+            async def _run():
+                fetch_sem = asyncio.Semaphore(8)
+
+                async def _fetch(doi):
+                    async with fetch_sem:
+                        logger.debug("Processing DOI: %s", doi)
+                        paper = await self._get_paper_by_doi_async(doi)
+                    if not paper:
+                        logger.warning("Could not fetch paper data for DOI: %s", doi)
+                    return paper
+
+                papers = [p for p in await asyncio.gather(*(_fetch(d) for d in dois)) if p]
+                if not papers:
+                    return
+
+                prompts = await asyncio.to_thread(self.generate_image_prompts_batch, papers)
+
+                for paper, prompt in zip(papers, prompts):
+                    title = paper.get('title', 'No title')
+                    logger.info("Processing paper: %s", title)
+                    logger.debug("Generated prompt: %s", prompt)
+                    # generate_image only writes local files, so run the
+                    # papers back to back in one worker thread
+                    if await asyncio.to_thread(self.generate_image, prompt, title):
+                        logger.info("Successfully generated image for: %s", title)
                     else:
-                        print(f"Failed to generate image for: {title}")
-                else:
-                    print(f"Could not fetch paper data for DOI: {doi}")
-                    
-                # Add a small delay to avoid rate limiting
-                time.sleep(1)
-                    
+                        logger.error("Failed to generate image for: %s", title)
+
+            asyncio.run(_run())
+
         except Exception as e:
-            print(f"Error processing log file: {e}")
-            
+            logger.error("Error processing log file: %s", e)
+
 def main():
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
     generator = PaperImageGenerator()
     generator.process_log_file()
 
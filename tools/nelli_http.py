@@ -0,0 +1,15 @@
+import httpx
+
+# One connection pool shared across the whole project. Every OpenAI client and
+# tool module reuses these, so the TLS handshake is paid once per host and
+# HTTP/2 multiplexes concurrent requests over kept-alive sockets instead of
+# each module opening its own pool.
+_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+
+shared_http = httpx.Client(limits=_LIMITS, http2=True, timeout=30)
+
+# NOTE: the async pool's connections are bound to the event loop they were
+# opened on. Callers must run everything on a single loop (one asyncio.run
+# for the whole program); a second asyncio.run in the same process will hit
+# stale connections and fail with "Event loop is closed".
+shared_async_http = httpx.AsyncClient(limits=_LIMITS, http2=True, timeout=30)
@@ -1,36 +1,156 @@
 import os
-from openai import OpenAI
+import sys
+import mmap
+import asyncio
+import hashlib
+import threading
+from openai import OpenAI, AsyncOpenAI
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
 import json
 from typing import Dict, List
 from datetime import datetime
+import logging
+
+try:
+    from tools.nelli_http import shared_http, shared_async_http
+except ImportError:  # Running from inside tools/
+    from nelli_http import shared_http, shared_async_http
 
 # Initialize OpenAI with LBL specifics
 client = OpenAI(
     api_key=os.environ.get('CBORG_API_KEY'), # Please do not store your API key in the code
-    base_url="https://api.cborg.lbl.gov" # Local clients can also use https://api-local.cborg.lbl.gov
+    base_url="https://api.cborg.lbl.gov", # Local clients can also use https://api-local.cborg.lbl.gov
+    http_client=shared_http
+)
+
+# Async client for the concurrent summarization path
+aclient = AsyncOpenAI(
+    api_key=os.environ.get('CBORG_API_KEY'),
+    base_url="https://api.cborg.lbl.gov",
+    http_client=shared_async_http
 )
 
 model = "lbl/cborg-coder:latest"
 
+logger = logging.getLogger(__name__)
+
+# Compiled once at import instead of per call; a bytes pattern so the scan
+# can run over an mmap of the log without decoding the whole file
+_DOI_PATTERN = re.compile(rb'DOI: (10\.\d{4,9}/[-._;()/:\w]+)')
+
+# HTML/JATS markup in abstracts is noise the model doesn't need
+_TAG_RE = re.compile(r'<[^>]+>')
+
+# Cap prompt input at roughly 1800 tokens (~4 chars per token): a 300-word
+# summary gains nothing from more context, and LLM latency scales with
+# prompt length
+_ABSTRACT_CHAR_BUDGET = 1800 * 4
+
 class PaperSummarizer:
-    def __init__(self, log_file: str = "paper_notifications.log", summary_output_file: str = "summary_output.log"):
+    def __init__(self, log_file: str = "paper_notifications.log", summary_output_file: str = "summary_output.log",
+                 summary_jsonl_file: str = "summaries.jsonl", force: bool = False, want_full_text: bool = False):
         self.log_file = log_file
         self.summary_output_file = summary_output_file
+        self.summary_jsonl_file = summary_jsonl_file
         self.base_url = "https://api.biorxiv.org"
+        # force=True bypasses the caches and re-fetches/re-summarizes everything
+        self.force = force
+        # The summarization prompt only uses title and abstract, so the
+        # multi-MB JATS XML download is skipped unless explicitly wanted
+        self.want_full_text = want_full_text
+
+        # Keep-alive session for the sync path: the TLS handshake is paid
+        # once instead of per request, and transient failures get retried
+        # with exponential backoff
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=16, pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.5,
+                              status_forcelist=[429, 500, 502, 503, 504])
+        ))
+
+        # On-disk cache of paper records and LLM summaries: biorxiv records
+        # and model output rarely change, so re-runs skip both the network
+        # and the model for papers already processed
+        self.cache_path = '.summarizer_cache.json'
+        self.cache = {'papers': {}, 'summaries': {}}
+        # Serializes the truncate-and-write below: summarize_all fans
+        # summarize_paper out over a thread pool and every worker saves,
+        # and two interleaved writers would corrupt the file
+        self._cache_lock = threading.Lock()
+        # DOIs fully summarized on previous runs; process_log_file skips them
+        self.summarized_dois = set()
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, 'r') as f:
+                    loaded = json.load(f)
+                self.cache['papers'] = loaded.get('papers', {})
+                self.cache['summaries'] = loaded.get('summaries', {})
+                self.summarized_dois = set(loaded.get('summarized_dois', []))
+            except Exception as e:
+                logger.warning("Could not load summarizer cache: %s", e)
+
+        # DOI -> jatsxml URL mapping remembered across runs, so on later
+        # passes the details and XML requests can be issued concurrently
+        # instead of strictly one after the other
+        self._jats_url_cache_path = '.jats_url_cache.json'
+        self._jats_urls = {}
+        if os.path.exists(self._jats_url_cache_path):
+            try:
+                with open(self._jats_url_cache_path, 'r') as f:
+                    self._jats_urls = json.load(f)
+            except Exception as e:
+                logger.warning("Could not load JATS URL cache: %s", e)
+
+    def _save_cache(self):
+        """Flush the paper/summary cache to disk"""
+        try:
+            with self._cache_lock:
+                self.cache['summarized_dois'] = sorted(self.summarized_dois)
+                with open(self.cache_path, 'w') as f:
+                    json.dump(self.cache, f)
+        except Exception as e:
+            logger.warning("Could not save summarizer cache: %s", e)
+
+    def _paper_cache_key(self, doi: str, server: str) -> str:
+        """Cache key for a paper record. The full-text flag is part of the
+        key, so a want_full_text run never gets served a record that was
+        cached without its full_text."""
+        return f"{server}/{doi}/full" if self.want_full_text else f"{server}/{doi}"
+
+    def _summary_key(self, request: Dict) -> str:
+        """Content-addressed key: the same model and prompt yield the same summary"""
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    def _save_jats_urls(self):
+        """Flush the DOI -> jatsxml URL mapping to disk"""
+        try:
+            with open(self._jats_url_cache_path, 'w') as f:
+                json.dump(self._jats_urls, f)
+        except Exception as e:
+            logger.warning("Could not save JATS URL cache: %s", e)
 
     def get_paper_by_doi(self, doi: str, server: str = "biorxiv") -> Dict:
         """Fetch paper data from biorxiv using DOI"""
+        cache_key = self._paper_cache_key(doi, server)
+        if not self.force and cache_key in self.cache['papers']:
+            return self.cache['papers'][cache_key]
+
         try:
             # First get the paper details
             details_endpoint = f"{self.base_url}/details/{server}/{doi}/na/json"
-            print(f"Fetching paper details from: {details_endpoint}")
-            details_response = requests.get(details_endpoint)
+            logger.debug("Fetching paper details from: %s", details_endpoint)
+            details_response = self.session.get(details_endpoint, timeout=(5, 30))
             details_response.raise_for_status()
             paper_details = details_response.json()
             
-            print(f"Paper details response: {json.dumps(paper_details, indent=2)}")
+            # Deferred and guarded: the payload is only pretty-printed when
+            # DEBUG is actually enabled
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Paper details response: %s", json.dumps(paper_details))
             
             # Extract data from the collection
             if 'collection' in paper_details and paper_details['collection']:
@@ -46,46 +166,115 @@ class PaperSummarizer:
                     'category': paper_info.get('category', '')
                 }
                 
-                # Try to get the full text if available
-                if 'jatsxml' in paper_info:
+                # Try to get the full text if explicitly wanted
+                if self.want_full_text and 'jatsxml' in paper_info:
                     try:
                         xml_url = paper_info['jatsxml']
-                        print(f"Fetching XML content from: {xml_url}")
-                        xml_response = requests.get(xml_url)
+                        logger.debug("Fetching XML content from: %s", xml_url)
+                        xml_response = self.session.get(xml_url, timeout=(5, 30))
                         xml_response.raise_for_status()
                         extracted_data['full_text'] = xml_response.text
                     except Exception as e:
-                        print(f"Could not fetch XML content: {e}")
+                        logger.warning("Could not fetch XML content: %s", e)
                         extracted_data['full_text'] = ''
-                
+
+                with self._cache_lock:
+                    self.cache['papers'][cache_key] = extracted_data
+                self._save_cache()
                 return extracted_data
             else:
-                print("No collection found in paper details")
+                logger.warning("No collection found in paper details")
                 return {}
-                
+
         except requests.exceptions.RequestException as e:
-            print(f"Error fetching paper by DOI: {e}")
+            logger.error("Error fetching paper by DOI: %s", e)
             if hasattr(e.response, 'text'):
-                print(f"Response text: {e.response.text}")
+                logger.debug("Response text: %s", e.response.text)
             return {}
         except Exception as e:
-            print(f"Unexpected error: {e}")
+            logger.error("Unexpected error: %s", e)
             return {}
 
-    def summarize_paper(self, paper_data: Dict) -> str:
-        """Generate summary using internal AI system"""
+    async def _fetch_xml_text(self, xml_url: str) -> str:
+        """Fetch the JATS XML, returning '' on failure"""
         try:
-            # Extract relevant information from paper data
-            title = paper_data.get('title', '')
-            abstract = paper_data.get('abstract', '')
-            full_text = paper_data.get('full_text', '')
-            
-            print(f"Title: {title}")
-            print(f"Abstract length: {len(abstract)}")
-            print(f"Full text length: {len(full_text)}")
-            
-            # Create prompt for summarization using only title and abstract
-            prompt = f"""Please provide a 300-word summary of the following scientific paper:
+            xml_response = await shared_async_http.get(xml_url)
+            xml_response.raise_for_status()
+            return xml_response.text
+        except Exception as e:
+            logger.warning("Could not fetch XML content: %s", e)
+            return ''
+
+    async def get_paper_by_doi_async(self, doi: str, server: str = "biorxiv") -> Dict:
+        """Async counterpart of get_paper_by_doi, using the shared connection pool.
+
+        When the jatsxml URL is already known from a prior run, the details
+        and XML requests go out together, roughly halving per-paper latency.
+        """
+        cache_key = self._paper_cache_key(doi, server)
+        if not self.force and cache_key in self.cache['papers']:
+            return self.cache['papers'][cache_key]
+
+        try:
+            details_endpoint = f"{self.base_url}/details/{server}/{doi}/na/json"
+            logger.debug("Fetching paper details from: %s", details_endpoint)
+            known_xml_url = self._jats_urls.get(doi) if self.want_full_text else None
+            full_text = None
+            if known_xml_url:
+                logger.debug("Fetching XML content from: %s", known_xml_url)
+                details_response, full_text = await asyncio.gather(
+                    shared_async_http.get(details_endpoint),
+                    self._fetch_xml_text(known_xml_url)
+                )
+            else:
+                details_response = await shared_async_http.get(details_endpoint)
+            details_response.raise_for_status()
+            paper_details = details_response.json()
+
+            if 'collection' in paper_details and paper_details['collection']:
+                paper_info = paper_details['collection'][0]
+
+                extracted_data = {
+                    'title': paper_info.get('title', ''),
+                    'abstract': paper_info.get('abstract', ''),
+                    'authors': paper_info.get('authors', ''),
+                    'doi': paper_info.get('doi', ''),
+                    'date': paper_info.get('date', ''),
+                    'category': paper_info.get('category', '')
+                }
+
+                # Try to get the full text if explicitly wanted
+                if self.want_full_text and 'jatsxml' in paper_info:
+                    xml_url = paper_info['jatsxml']
+                    if self._jats_urls.get(doi) != xml_url:
+                        self._jats_urls[doi] = xml_url
+                        self._save_jats_urls()
+                    if full_text is None or xml_url != known_xml_url:
+                        # First sighting, or the URL changed under us
+                        logger.debug("Fetching XML content from: %s", xml_url)
+                        full_text = await self._fetch_xml_text(xml_url)
+                    extracted_data['full_text'] = full_text
+
+                with self._cache_lock:
+                    self.cache['papers'][cache_key] = extracted_data
+                self._save_cache()
+                return extracted_data
+            else:
+                logger.warning("No collection found in paper details")
+                return {}
+
+        except Exception as e:
+            logger.error("Error fetching paper by DOI: %s", e)
+            return {}
+
+    def _build_prompt(self, paper_data: Dict) -> Dict:
+        """Build the chat messages for summarizing a paper (shared by sync and batch paths)"""
+        title = paper_data.get('title', '')
+        # Strip markup tags, then truncate to the token budget
+        abstract = _TAG_RE.sub('', paper_data.get('abstract', ''))[:_ABSTRACT_CHAR_BUDGET]
+
+        # Create prompt for summarization using only title and abstract
+        prompt = f"""Please provide a 300-word summary of the following scientific paper:
 
 Title: {title}
 
@@ -94,22 +283,75 @@ Abstract: {abstract}
 #Full Text: full_text add brackets back if using
 
 Summary:"""
-            
+
+        return {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": "You are a scientific paper summarizer. Provide clear, concise summaries of scientific paper provided in exactly 300 words. I want the summary to be for social media, specifically bluesky, so it should be fun and engaging."},
+                {"role": "user", "content": prompt}
+            ]
+        }
+
+    def summarize_paper(self, paper_data: Dict) -> str:
+        """Generate summary using internal AI system"""
+        try:
+            # Nothing to summarize: skip the round-trip entirely
+            if not paper_data.get('abstract') and not paper_data.get('full_text'):
+                logger.warning("No abstract or full text for %s; skipping summary",
+                               paper_data.get('doi', 'unknown DOI'))
+                return ''
+
+            logger.debug("Title: %s", paper_data.get('title', ''))
+            logger.debug("Abstract length: %d", len(paper_data.get('abstract', '')))
+            logger.debug("Full text length: %d", len(paper_data.get('full_text', '')))
+
+            request = self._build_prompt(paper_data)
+            key = self._summary_key(request)
+            if not self.force and key in self.cache['summaries']:
+                return self.cache['summaries'][key]
+
             # Call the internal AI system
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are a scientific paper summarizer. Provide clear, concise summaries of scientific paper provided in exactly 300 words. I want the summary to be for social media, specifically bluesky, so it should be fun and engaging."},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            return response.choices[0].message.content.strip()
-            
+            response = client.chat.completions.create(**request)
+
+            summary = response.choices[0].message.content.strip()
+            with self._cache_lock:
+                self.cache['summaries'][key] = summary
+            self._save_cache()
+            return summary
+
         except Exception as e:
-            print(f"Error generating summary: {e}")
-            return "Error generating summary"
+            # Empty like the no-abstract path, so callers skip the paper
+            # instead of logging/posting the error text as a summary
+            logger.error("Error generating summary: %s", e)
+            return ''
             
+    async def summarize_paper_async(self, paper_data: Dict) -> str:
+        """Async counterpart of summarize_paper"""
+        try:
+            # Nothing to summarize: skip the round-trip entirely
+            if not paper_data.get('abstract') and not paper_data.get('full_text'):
+                logger.warning("No abstract or full text for %s; skipping summary",
+                               paper_data.get('doi', 'unknown DOI'))
+                return ''
+
+            request = self._build_prompt(paper_data)
+            key = self._summary_key(request)
+            if not self.force and key in self.cache['summaries']:
+                return self.cache['summaries'][key]
+
+            response = await aclient.chat.completions.create(**request)
+
+            summary = response.choices[0].message.content.strip()
+            with self._cache_lock:
+                self.cache['summaries'][key] = summary
+            self._save_cache()
+            return summary
+        except Exception as e:
+            # Empty like the no-abstract path, so callers skip the paper
+            # instead of logging/posting the error text as a summary
+            logger.error("Error generating summary: %s", e)
+            return ''
+
     def log_summary_to_file(self, paper_data: Dict, summary: str):
         """Log the paper summary to the summary output file"""
         try:
@@ -126,55 +368,103 @@ Summary:"""
                 f.write("\nSummary:\n")
                 f.write(summary + "\n")
                 f.write("="*50 + "\n")
-                
-            print(f"Summary logged to {self.summary_output_file}")
+
+            # Structured twin of the log entry: one JSON object per line, so
+            # consumers can json.loads each line instead of re-parsing blocks
+            with open(self.summary_jsonl_file, 'a') as jf:
+                jf.write(json.dumps({
+                    'title': paper_data.get('title', ''),
+                    'doi': paper_data.get('doi', ''),
+                    'authors': paper_data.get('authors', ''),
+                    'date': paper_data.get('date', ''),
+                    'category': paper_data.get('category', ''),
+                    'summary': summary
+                }) + '\n')
+
+            logger.info("Summary logged to %s", self.summary_output_file)
             
         except Exception as e:
-            print(f"Error logging summary to file: {e}")
+            logger.error("Error logging summary to file: %s", e)
 
     def process_log_file(self):
         """Read DOIs from log file and generate summaries"""
         try:
-            with open(self.log_file, 'r') as f:
-                content = f.read()
-                
-            # Extract DOIs using regex
-            doi_pattern = r'DOI: (10\.\d{4,9}/[-._;()/:\w]+)'
-            dois = re.findall(doi_pattern, content)
+            # Memory-map the log so the regex scans the OS page cache
+            # directly, with no whole-file string copy or decode
+            dois = []
+            with open(self.log_file, 'rb') as f:
+                if os.path.getsize(self.log_file) > 0:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        # Dedup while preserving order so repeated log
+                        # entries aren't re-fetched
+                        dois = [m.decode() for m in dict.fromkeys(_DOI_PATTERN.findall(mm))]
             
             if not dois:
-                print("No DOIs found in log file")
+                logger.warning("No DOIs found in log file")
                 return
-                
-            print(f"\nFound {len(dois)} papers to summarize")
-            
-            # Process each DOI
-            for doi in dois:
-                print(f"\nProcessing DOI: {doi}")
-                paper_data = self.get_paper_by_doi(doi)
-                
-                if paper_data:
-                    summary = self.summarize_paper(paper_data)
-                    print("\n" + "="*80)
-                    print(f"Title: {paper_data.get('title', 'No title')}")
-                    print("\nDOI: ")
-                    print(f"{paper_data.get('doi', 'No doi')}")
-                    print("\nAuthors: ")
-                    print(f"{paper_data.get('authors', 'No authors')}")
-                    print("\nSummary:")
-                    print(summary)
-                    print("="*80)
-                    
-                    # Log the summary to the output file
-                    self.log_summary_to_file(paper_data, summary)
-                else:
-                    print(f"Could not fetch paper data for DOI: {doi}")
-                    
+
+            # Skip papers summarized on previous runs unless forced
+            if not self.force:
+                skipped = len(dois)
+                dois = [doi for doi in dois if doi not in self.summarized_dois]
+                skipped -= len(dois)
+                if skipped:
+                    logger.info("Skipping %d already-summarized papers", skipped)
+
+            if not dois:
+                logger.info("All papers have already been summarized")
+                return
+
+            logger.info("Found %d papers to summarize", len(dois))
+
+            # Fetch and summarize the DOIs concurrently; separate semaphores
+            # bound the in-flight biorxiv requests and the simultaneous LLM
+            # completions independently
+            async def _handle(doi: str, fetch_sem: asyncio.Semaphore, llm_sem: asyncio.Semaphore):
+                async with fetch_sem:
+                    logger.debug("Processing DOI: %s", doi)
+                    paper_data = await self.get_paper_by_doi_async(doi)
+
+                if not paper_data:
+                    logger.warning("Could not fetch paper data for DOI: %s", doi)
+                    return
+
+                async with llm_sem:
+                    summary = await self.summarize_paper_async(paper_data)
+
+                if not summary:
+                    return
+
+                print("\n" + "="*80)
+                print(f"Title: {paper_data.get('title', 'No title')}")
+                print("\nDOI: ")
+                print(f"{paper_data.get('doi', 'No doi')}")
+                print("\nAuthors: ")
+                print(f"{paper_data.get('authors', 'No authors')}")
+                print("\nSummary:")
+                print(summary)
+                print("="*80)
+
+                # Log the summary to the output file
+                self.log_summary_to_file(paper_data, summary)
+                with self._cache_lock:
+                    self.summarized_dois.add(doi)
+                self._save_cache()
+
+            async def _run():
+                fetch_sem = asyncio.Semaphore(32)
+                llm_sem = asyncio.Semaphore(16)
+                await asyncio.gather(*(_handle(doi, fetch_sem, llm_sem) for doi in dois))
+
+            asyncio.run(_run())
+
         except Exception as e:
-            print(f"Error processing log file: {e}")
+            logger.error("Error processing log file: %s", e)
 
 def main():
-    summarizer = PaperSummarizer()
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+    # --force re-fetches and re-summarizes even when cached
+    summarizer = PaperSummarizer(force='--force' in sys.argv)
     summarizer.process_log_file()
 
 if __name__ == "__main__":
@@ -0,0 +1,17 @@
+import re
+from functools import lru_cache
+
+# Compiled once at import instead of per call
+_SAFE1 = re.compile(r'[^\w\s-]')
+_SAFE2 = re.compile(r'[-\s]+')
+
+
+@lru_cache(maxsize=1024)
+def sanitize_title(title: str) -> str:
+    """Build a filesystem-safe name from a paper title.
+
+    Shared between image generation and posting so both sides derive the
+    same filename; memoized since the same titles recur across runs.
+    """
+    safe_title = _SAFE1.sub('', title)
+    return _SAFE2.sub('_', safe_title).strip('-_')